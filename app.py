@@ -3,6 +3,9 @@ from openai import OpenAI
 import os
 import tempfile
 import json
+import re
+import difflib
+import unicodedata
 
 # ========== v2.3.1 升级：版本号与配置集中管理 ==========
 VERSION = "2.3.1"
@@ -17,6 +20,11 @@ CONFIG = {
         "transcribe": "FunAudioLLM/SenseVoiceSmall",
         "generate": "deepseek-ai/DeepSeek-V3"
     },
+    "incremental": {
+        "max_change_ratio": 0.15,
+        "context_chars": 30,
+        "min_context_overlap": 0.3
+    },
     "theme": {
         "light": {
             "bg_primary": "#ffffff",
@@ -462,6 +470,208 @@ def transcribe_audio(audio_bytes: bytes, api_key: str) -> dict:
         if tmp_path and os.path.exists(tmp_path):
             os.unlink(tmp_path)
 
+# ========== 简报生成函数（全量 / 增量） ==========
+SECTION_MARKER = "<<<SECTION {}>>>"
+HEADING_PATTERN = re.compile(r"^(#{1,6})\s+\S")
+BOLD_HEADING_PATTERN = re.compile(r"^(\d+[\.、]\s*)?\*\*[^*]+\*\*\s*$")
+
+def count_tokens(response, messages: list, output_text: str) -> int:
+    """统计一次调用消耗的 token（优先使用接口返回的 usage，否则按字数估算）"""
+    usage = getattr(response, "usage", None)
+    total = getattr(usage, "total_tokens", None) if usage else None
+    if total:
+        return total
+    return sum(len(m["content"]) for m in messages) + len(output_text)
+
+def generate_briefing(client: OpenAI, prompt: str, content: str) -> dict:
+    """全量生成简报"""
+    messages = [
+        {"role": "system", "content": prompt},
+        {"role": "user", "content": content}
+    ]
+    response = client.chat.completions.create(
+        model=CONFIG['models']['generate'],
+        messages=messages,
+        temperature=0.7,
+        max_tokens=2000
+    )
+    text = response.choices[0].message.content
+    return {"text": text, "tokens": count_tokens(response, messages, text)}
+
+def _widen_span(text: str, start: int, end: int) -> str:
+    """向两侧扩展改动片段直到至少 2 个字，便于在简报中直接匹配（如 李四→李思 的改动只有「四」）"""
+    while len(text[start:end].strip()) < 2 and (start > 0 or end < len(text)):
+        if start > 0:
+            start -= 1
+        if len(text[start:end].strip()) < 2 and end < len(text):
+            end += 1
+    return text[start:end].strip()
+
+def _strip_layout(text: str) -> str:
+    """去掉空白与标点，只保留影响内容的字符"""
+    return "".join(ch for ch in text if not ch.isspace() and not unicodedata.category(ch).startswith("P"))
+
+def diff_transcript(old: str, new: str) -> dict:
+    """比较编辑前后的原文，返回改动比例与改动片段（忽略只改空白或标点的片段）"""
+    matcher = difflib.SequenceMatcher(None, old, new, autojunk=False)
+    context_chars = CONFIG['incremental']['context_chars']
+    edits = []
+    changed = 0
+    
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal" or _strip_layout(old[i1:i2]) == _strip_layout(new[j1:j2]):
+            continue
+        changed += max(i2 - i1, j2 - j1)
+        edits.append({
+            "old": old[i1:i2],
+            "new": new[j1:j2],
+            "needle": _widen_span(old, i1, i2),
+            "context": old[max(0, i1 - context_chars):i2 + context_chars]
+        })
+    
+    return {"change_ratio": changed / max(len(old), 1), "edits": edits}
+
+def split_briefing_sections(text: str) -> tuple:
+    """按顶层标题（最高一级 # 标题或整行加粗标题）拆分简报，返回（开头部分, 章节列表）
+    
+    下级标题与列表项（包括编号列表）归入所在章节；单独的总标题归入开头部分。
+    识别不到标题时章节列表为空，由调用方全量生成。
+    """
+    lines = text.split("\n")
+    levels = {}
+    for i, line in enumerate(lines):
+        match = HEADING_PATTERN.match(line)
+        if match:
+            levels[i] = len(match.group(1))
+    
+    if levels:
+        top = min(levels.values())
+        first = min(levels)
+        if len(levels) > 1 and levels[first] == top and list(levels.values()).count(top) == 1:
+            # 只出现一次的最高级标题（如 # 会议纪要）是总标题，不作为章节
+            del levels[first]
+            top = min(levels.values())
+        starts = {i for i, level in levels.items() if level == top}
+    else:
+        starts = {i for i, line in enumerate(lines) if BOLD_HEADING_PATTERN.match(line)}
+    
+    preamble = []
+    sections = []
+    for i, line in enumerate(lines):
+        if i in starts:
+            sections.append([line])
+        elif sections:
+            sections[-1].append(line)
+        else:
+            preamble.append(line)
+    
+    return "\n".join(preamble), ["\n".join(section) for section in sections]
+
+def _bigrams(text: str) -> set:
+    text = re.sub(r"\s+", "", text)
+    return {text[i:i + 2] for i in range(len(text) - 1)}
+
+def map_edits_to_sections(edits: list, sections: list) -> set:
+    """将原文改动映射到受影响的章节，无法映射时返回 None"""
+    affected = set()
+    
+    for edit in edits:
+        needle = edit["needle"]
+        matched = {i for i, section in enumerate(sections) if len(needle) >= 2 and needle in section}
+        
+        if not matched:
+            # 改动的词未直接出现在简报中，按上下文的字符重合度找最相关的章节，重合太少则放弃
+            context = _bigrams(edit["context"])
+            scores = [len(context & _bigrams(section)) for section in sections]
+            best = max(scores)
+            if not context or best < len(context) * CONFIG['incremental']['min_context_overlap']:
+                return None
+            matched = {scores.index(best)}
+        
+        affected |= matched
+    
+    return affected
+
+def regenerate_briefing_sections(client: OpenAI, prompt: str, base_content: str, old_content: str,
+                                 new_content: str, previous_result: str) -> dict:
+    """增量生成：只重写受原文改动影响的章节，改动过大时返回失败以便全量生成
+    
+    base_content 为上次全量生成所用原文，用于限制多次小改动累积后的总改动比例。
+    """
+    diff = diff_transcript(old_content, new_content)
+    if old_content == new_content:
+        return {"success": False, "reason": "内容未改动"}
+    if not diff["edits"]:
+        # 只改了空白或标点，简报内容不受影响
+        return {"success": True, "text": previous_result, "tokens": 0, "sections": 0}
+    if diff["change_ratio"] > CONFIG['incremental']['max_change_ratio']:
+        return {"success": False, "reason": f"改动较大（{diff['change_ratio']:.0%}）"}
+    total_ratio = diff_transcript(base_content, new_content)["change_ratio"]
+    if total_ratio > CONFIG['incremental']['max_change_ratio']:
+        return {"success": False, "reason": f"累计改动较大（{total_ratio:.0%}）"}
+    
+    preamble, sections = split_briefing_sections(previous_result)
+    if len(sections) < 2:
+        return {"success": False, "reason": "无法识别简报章节"}
+    
+    affected = map_edits_to_sections(diff["edits"], sections)
+    if affected is None:
+        return {"success": False, "reason": "无法定位改动对应的章节"}
+    if len(affected) == len(sections):
+        return {"success": False, "reason": "改动涉及全部章节"}
+    
+    edit_lines = "\n".join(
+        f"- 「{edit['old']}」→「{edit['new']}」（原文上下文：{edit['context']}）"
+        for edit in diff["edits"]
+    )
+    unchanged = "\n\n".join(section for i, section in enumerate(sections) if i not in affected)
+    targets = "\n\n".join(
+        f"{SECTION_MARKER.format(i + 1)}\n{sections[i]}" for i in sorted(affected)
+    )
+    
+    messages = [
+        {"role": "system", "content": (
+            f"{prompt}。现在只需增量更新一份已生成的简报：原文仅有少量修改，"
+            f"请根据修改重写指定章节，保持原有标题与格式，不要输出其它章节。"
+            f"每个章节前必须保留原样的标记行，如 {SECTION_MARKER.format(1)}"
+        )},
+        {"role": "user", "content": (
+            f"原文修改：\n{edit_lines}\n\n"
+            f"未改动的章节（仅供参考）：\n{unchanged}\n\n"
+            f"需要重写的章节：\n{targets}"
+        )}
+    ]
+    response = client.chat.completions.create(
+        model=CONFIG['models']['generate'],
+        messages=messages,
+        temperature=0.7,
+        max_tokens=2000
+    )
+    output = response.choices[0].message.content
+    tokens = count_tokens(response, messages, output)
+    
+    parts = re.split(r"<<<SECTION (\d+)>>>", output)
+    rewritten = {int(parts[k]) - 1: parts[k + 1].strip("\n") for k in range(1, len(parts) - 1, 2)}
+    if not affected.issubset(rewritten):
+        return {"success": False, "reason": "增量结果格式异常", "tokens": tokens}
+    
+    for i in affected:
+        heading = sections[i].split("\n", 1)[0]
+        if not rewritten[i].lstrip().startswith(heading.strip()):
+            # 模型改写时常丢掉标题行，补回以免下次增量拆分出错
+            rewritten[i] = f"{heading}\n{rewritten[i]}"
+        trailing = sections[i][len(sections[i].rstrip("\n")):]
+        sections[i] = rewritten[i] + trailing
+    text = "\n".join(part for part in [preamble] + sections if part)
+    
+    return {
+        "success": True,
+        "text": text,
+        "tokens": tokens,
+        "sections": len(affected),
+        "total_sections": len(sections)
+    }
+
 # ========== 主界面 ==========
 col1, col2 = st.columns([1, 1])
 
@@ -606,6 +816,13 @@ with col2:
     
     custom_req = st.text_input("特殊要求", placeholder="例如：重点突出数据、使用 bullet points")
     
+    incremental = st.checkbox(
+        "⚡ 增量更新",
+        value=True,
+        key="incremental_mode",
+        help="小幅修改内容后，只重新生成受影响的章节；改动较大时自动全量生成"
+    )
+    
     col_gen, col_clear = st.columns([3, 1])
     with col_gen:
         if st.button("✨ 生成简报", type="primary", use_container_width=True):
@@ -628,17 +845,41 @@ with col2:
                         if custom_req:
                             prompt += f"。要求：{custom_req}"
                         
-                        response = client.chat.completions.create(
-                            model=CONFIG['models']['generate'],
-                            messages=[
-                                {"role": "system", "content": prompt},
-                                {"role": "user", "content": content}
-                            ],
-                            temperature=0.7,
-                            max_tokens=2000
-                        )
+                        result = None
+                        if (incremental and "generated_full_source" in st.session_state
+                                and st.session_state.get("generated_prompt") == prompt):
+                            result = regenerate_briefing_sections(
+                                client, prompt,
+                                st.session_state.generated_full_source,
+                                st.session_state.generated_source, content,
+                                st.session_state.generated_result
+                            )
+                        
+                        if result and result["success"] and result["sections"] == 0:
+                            st.session_state.generation_note = "⚡ 仅改动空白或标点，已保留原简报，未消耗 tokens"
+                        elif result and result["success"]:
+                            # 按原文长度变化折算全量生成的消耗，作为节省的对比基准
+                            full_source = st.session_state.generated_full_source
+                            baseline = round(st.session_state.generated_tokens * len(content) / max(len(full_source), 1))
+                            saved = baseline - result["tokens"]
+                            st.session_state.generation_note = (
+                                f"⚡ 增量更新 {result['sections']}/{result['total_sections']} 个章节，"
+                                f"消耗 {result['tokens']} tokens，节省约 {max(saved, 0)} tokens"
+                            )
+                        else:
+                            fallback = ""
+                            if result:
+                                spent = result.get("tokens", 0)
+                                fallback = f"（{result['reason']}，已全量生成"
+                                fallback += f"；增量尝试另耗 {spent} tokens）" if spent else "）"
+                            result = generate_briefing(client, prompt, content)
+                            st.session_state.generated_tokens = result["tokens"]
+                            st.session_state.generated_full_source = content
+                            st.session_state.generation_note = f"全量生成，消耗 {result['tokens']} tokens{fallback}"
                         
-                        st.session_state.generated_result = response.choices[0].message.content
+                        st.session_state.generated_result = result["text"]
+                        st.session_state.generated_source = content
+                        st.session_state.generated_prompt = prompt
                         
                     except Exception as e:
                         # v2.3.1 升级：错误分类
@@ -654,13 +895,17 @@ with col2:
     with col_clear:
         if st.button("🗑️ 清空", use_container_width=True):
             st.session_state.transcribed_text = ""
-            if "generated_result" in st.session_state:
-                del st.session_state.generated_result
+            for key in ["generated_result", "generated_source", "generated_full_source",
+                        "generated_prompt", "generated_tokens", "generation_note"]:
+                if key in st.session_state:
+                    del st.session_state[key]
             st.rerun()
     
     if "generated_result" in st.session_state:
         st.divider()
         st.success("✅ 生成完成！")
+        if st.session_state.get("generation_note"):
+            st.caption(st.session_state.generation_note)
         st.markdown(st.session_state.generated_result)
         st.download_button(
             "📋 下载",